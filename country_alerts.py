@@ -2,12 +2,20 @@
 # Unified agent: RSS + Google CSE -> (Gemini ByteSize-style summary ->) Discord
 # Windows-safe UTF-8 logging; smart filter removes "playlist" noise but keeps "history".
 
-import os, sys, json, io
+import os, sys, io, re, asyncio, hashlib, calendar, sqlite3, threading
+import orjson
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from itertools import groupby, islice
 from datetime import datetime as dt, timezone, timedelta
+from urllib.parse import urlparse, urlsplit, urlunsplit, parse_qsl, urlencode
 from typing import List, Dict, Tuple
 import requests
-import feedparser
-from bs4 import BeautifulSoup
+from requests.adapters import HTTPAdapter
+from urllib3.util import Retry
+import aiohttp
+import fastfeedparser as feedparser  # lxml-backed, same .entries API as feedparser
+from selectolax.parser import HTMLParser
+import ahocorasick
 from html import escape
 
 # ---------- Windows-safe stdout/stderr (avoids cp1252/charmap issues) ----------
@@ -44,6 +52,15 @@ DEFAULT_ARTISTS = [
 # Allow CLI override for quick tests: python country_alerts.py "Luke Combs"
 ARTISTS = [sys.argv[1]] if len(sys.argv) > 1 else DEFAULT_ARTISTS
 
+ARTISTS_LC = [a.lower() for a in ARTISTS]
+
+# One automaton over the whole roster: each entry's text is scanned once
+# instead of once per artist.
+AC = ahocorasick.Automaton()
+for _i, (_a, _a_lc) in enumerate(zip(ARTISTS, ARTISTS_LC)):
+    AC.add_word(_a_lc, (_i, _a))
+AC.make_automaton()
+
 # Time/volume knobs
 LOOKBACK_HOURS_RSS = 24
 CSE_RESULTS_PER_ARTIST = 8
@@ -59,10 +76,22 @@ RSS_FEEDS = [
     "https://variety.com/v/music/news/feed/",
     "https://consequence.net/music/feed/",
 ]
+# Feeds whose entries are known to interleave out of date order; everything
+# else is newest-first, so the scan stops at the first stale entry.
+OUT_OF_ORDER_FEEDS: set = set()
 TRUSTED_HOSTS = (
     "billboard.com","rollingstone.com","variety.com",
     "countrynow.com","theboot.com","consequence.net","tasteofcountry.com"
 )
+TRUSTED_SET = frozenset(TRUSTED_HOSTS)
+
+def _trusted(url: str) -> bool:
+    # Compare against the actual host, not the whole URL (a trusted domain
+    # appearing in a path/query should not count).
+    host = urlparse(url or "").netloc.lower()
+    if host.startswith("www."):
+        host = host[4:]
+    return host in TRUSTED_SET or any(host.endswith("." + h) for h in TRUSTED_SET)
 
 # =========================
 # ENV / KEYS
@@ -86,75 +115,245 @@ if USE_GEMINI:
         print(f"[warn] Gemini unavailable ({e}); falling back to rules.")
         USE_GEMINI = False
 
+# ---------- Shared HTTP session (pooled, keepalive, retries) ----------
+SESSION = requests.Session()
+SESSION.mount("https://", HTTPAdapter(
+    pool_connections=20, pool_maxsize=20,
+    max_retries=Retry(total=2, backoff_factor=0.3,
+                      status_forcelist=(429, 500, 502, 503, 504))))
+
 # ---------- Discord ----------
-def send_discord(message: str):
+def send_discord(message: str = "", embeds: List[Dict] = None):
+    # Webhooks take up to 10 embeds per call, so batched alerts go out as
+    # one POST instead of one per alert.
     url = DISCORD_WEBHOOK_URL
     if not url:
         return
+    payload = {}
+    if message:
+        payload["content"] = message[:1900]
+    if embeds:
+        payload["embeds"] = embeds[:10]
+    if not payload:
+        return
     try:
-        requests.post(url, json={"content": message[:1900]}, timeout=15)
+        r = SESSION.post(url, json=payload, timeout=15)
+        if not r.ok:
+            print(f"[warn] Discord webhook returned {r.status_code}: {r.text[:200]}")
     except Exception as e:
         print(f"[warn] Discord send failed: {e}")
 
+# ---------- HTML -> text (C-backed parser) ----------
+def _strip_html(s: str) -> str:
+    # Collapse whitespace: selectolax inserts the separator at every text-node
+    # boundary, so inline markup would otherwise leave doubled spaces that
+    # break phrase matches on the stripped text.
+    return " ".join(HTMLParser(s or "").text(separator=" ").split())
+
+def _canonical_url(url: str) -> str:
+    # Drop tracking params and fragments so the same article seen via RSS
+    # and CSE dedups to one hit.
+    try:
+        parts = urlsplit(url or "")
+        q = [(k, v) for k, v in parse_qsl(parts.query, keep_blank_values=True)
+             if not k.lower().startswith("utm_")]
+        return urlunsplit((parts.scheme, parts.netloc, parts.path, urlencode(q), ""))
+    except Exception:
+        return url or ""
+
+def _title_text(t: str) -> str:
+    # Most feed titles are already plain text; only parse when tags are present.
+    return t if "<" not in t else _strip_html(t)
+
 # =========================
 # SMART FILTER
 # =========================
 PLAYLIST_TERMS = ("playlist","playlists","spotify playlist","apple music playlist","best playlist","curated playlist")
+_NOISE_RE = re.compile("|".join(re.escape(t) for t in PLAYLIST_TERMS))
 
 def is_noise_playlist(title: str, snippet: str, url: str) -> bool:
     text = f"{title} {snippet} {url}".lower()
     if "history" in text:
         return False
-    return any(term in text for term in PLAYLIST_TERMS)
+    return bool(_NOISE_RE.search(text))
 
 # =========================
 # RETRIEVAL: RSS + CSE
 # =========================
+# Conditional-GET cache: validators in .feedcache.json, bodies under .feedcache/.
+# A 304 reuses the cached body instead of re-downloading the feed.
+_FEED_CACHE_PATH = ".feedcache.json"
+_FEED_BODY_DIR = ".feedcache"
+
+def _load_feed_cache() -> Dict:
+    try:
+        with open(_FEED_CACHE_PATH, "rb") as f:
+            return orjson.loads(f.read())
+    except Exception:
+        return {}
+
+def _save_feed_cache(cache: Dict):
+    try:
+        with open(_FEED_CACHE_PATH, "wb") as f:
+            f.write(orjson.dumps(cache))
+    except Exception as e:
+        print(f"[warn] feed cache write failed: {e}")
+
+def _feed_body_path(url: str) -> str:
+    return os.path.join(_FEED_BODY_DIR, hashlib.sha1(url.encode("utf-8")).hexdigest() + ".xml")
+
+async def _fetch_all_feeds() -> List:
+    # One session, bounded connector; bodies come back in RSS_FEEDS order
+    # (failures come back as exceptions and are skipped by the caller).
+    cache = _load_feed_cache()
+    os.makedirs(_FEED_BODY_DIR, exist_ok=True)
+    timeout = aiohttp.ClientTimeout(total=15)
+    connector = aiohttp.TCPConnector(limit=16)
+    async with aiohttp.ClientSession(timeout=timeout, connector=connector) as session:
+        async def _one(url: str) -> bytes:
+            cached = cache.get(url) or {}
+            body_path = _feed_body_path(url)
+            headers = {}
+            # Conditional headers are only useful while the cached body is
+            # still on disk; a 304 without it would leave nothing to parse.
+            if os.path.exists(body_path):
+                if cached.get("etag"):
+                    headers["If-None-Match"] = cached["etag"]
+                if cached.get("lastmod"):
+                    headers["If-Modified-Since"] = cached["lastmod"]
+            async with session.get(url, headers=headers) as resp:
+                if resp.status == 304:
+                    try:
+                        with open(body_path, "rb") as f:
+                            return f.read()
+                    except OSError:
+                        # Body vanished since the check above: drop the stale
+                        # validators and refetch unconditionally.
+                        cache.pop(url, None)
+                        return await _one(url)
+                resp.raise_for_status()
+                body = await resp.read()
+                etag = resp.headers.get("ETag")
+                lastmod = resp.headers.get("Last-Modified")
+            if etag or lastmod:
+                cache[url] = {"etag": etag, "lastmod": lastmod,
+                              "mtime": dt.now(timezone.utc).timestamp()}
+                try:
+                    with open(body_path, "wb") as f:
+                        f.write(body)
+                except Exception:
+                    cache.pop(url, None)
+            return body
+        bodies = await asyncio.gather(*(_one(u) for u in RSS_FEEDS), return_exceptions=True)
+    _save_feed_cache(cache)
+    return bodies
+
 def recent_rss_hits() -> List[Dict]:
     since = dt.now(timezone.utc) - timedelta(hours=LOOKBACK_HOURS_RSS)
+    since_ts = calendar.timegm(since.utctimetuple())
     hits = []
-    for url in RSS_FEEDS:
+    try:
+        bodies = asyncio.run(_fetch_all_feeds())
+    except Exception as e:
+        print(f"[warn] RSS fetch failed: {e}")
+        return hits
+    for url, body in zip(RSS_FEEDS, bodies):
+        if isinstance(body, BaseException):
+            continue
+        ordered = url not in OUT_OF_ORDER_FEEDS
         try:
-            feed = feedparser.parse(url)
-            for e in feed.entries[:60]:
-                pub = getattr(e, "published_parsed", None) or getattr(e, "updated_parsed", None)
+            feed = feedparser.parse(body)
+            for e in feed.entries:
+                pub = (getattr(e, "published_parsed", None) or getattr(e, "updated_parsed", None)
+                       or getattr(e, "published", None) or getattr(e, "updated", None))
                 if not pub:
                     continue
-                pub_dt = dt(*pub[:6], tzinfo=timezone.utc)
-                if pub_dt < since:
+                if isinstance(pub, str):
+                    # fastfeedparser normalizes dates to ISO 8601 strings
+                    pub_dt = dt.fromisoformat(pub)
+                    if pub_dt.tzinfo is None:
+                        pub_dt = pub_dt.replace(tzinfo=timezone.utc)
+                    pub_ts = pub_dt.timestamp()
+                else:
+                    # Integer compare; the datetime is only built for entries
+                    # that survive the filters below.
+                    pub_ts = calendar.timegm(pub[:9])
+                if pub_ts < since_ts:
+                    if ordered:
+                        break
                     continue
                 title = e.title or ""
-                summary = BeautifulSoup(getattr(e, "summary",""), "html.parser").get_text(" ", strip=True)
                 link = e.link
+                # Cheap filters first: noise/artist checks on title+URL, then
+                # on the raw summary; the HTML strip is only paid for entries
+                # that actually match an artist.
+                if is_noise_playlist(title, "", link):
+                    continue
+                matched = {a for _, (_, a) in AC.iter((title + " " + link).lower())}
+                # fastfeedparser keeps RSS <description> under .description
+                # rather than normalizing it to .summary like feedparser did
+                raw_summary = getattr(e, "summary", None) or getattr(e, "description", "") or ""
+                summary = None
+                if not matched:
+                    # Lazy strip: only entries that miss on title/URL pay for
+                    # it, and matching stripped text keeps names that span
+                    # inline markup.
+                    summary = _strip_html(raw_summary)
+                    matched = {a for _, (_, a) in AC.iter(summary.lower())}
+                    if not matched:
+                        continue
+                if summary is None:
+                    summary = _strip_html(raw_summary)
                 if is_noise_playlist(title, summary, link):
                     continue
-                text = (title + " " + summary).lower()
-                for a in ARTISTS:
-                    if a.lower() in text:
-                        hits.append({
-                            "source":"rss",
-                            "artist":a,
-                            "title":title,
-                            "url":link,
-                            "snippet":summary,
-                            "published":pub_dt.isoformat(),
-                            "trusted": any(h in link for h in TRUSTED_HOSTS)
-                        })
+                pub_iso = dt.fromtimestamp(pub_ts, tz=timezone.utc).isoformat()
+                for a in matched:
+                    hits.append({
+                        "source":"rss",
+                        "artist":a,
+                        "title":title,
+                        "url":link,
+                        "snippet":summary,
+                        "published":pub_iso,
+                        "trusted": _trusted(link)
+                    })
         except Exception:
             continue
     return hits
 
+# Daily memo of CSE results: the same artist queries repeat across runs in a
+# day with near-identical results, and every live call burns paid quota.
+_CSE_CACHE_PATH = ".cse_cache.sqlite"
+_CSE_DB = sqlite3.connect(_CSE_CACHE_PATH, check_same_thread=False)
+_CSE_DB.execute("CREATE TABLE IF NOT EXISTS cse(q TEXT, day TEXT, ts REAL, body BLOB, PRIMARY KEY(q, day))")
+_CSE_LOCK = threading.Lock()  # google_search_news runs on the thread pool
+
+# Static pieces of every CSE call, built once instead of per artist.
+_CSE_STATIC_PARAMS = {"key": CSE_API_KEY, "cx": CSE_CX, "safe": "active", "hl": "en"}
+_CSE_SUFFIX = ('(news OR announces OR reveals OR controversy OR tour OR release OR update '
+               'OR statement OR apology OR backlash OR lawsuit) '
+               'site:(billboard.com OR rollingstone.com OR variety.com OR countrynow.com OR '
+               'tasteofcountry.com OR theboot.com OR consequence.net)')
+
 def google_search_news(query: str, num: int = 6) -> List[Dict]:
     if not CSE_API_KEY or not CSE_CX:
         return []
+    day = dt.now(timezone.utc).date().isoformat()
     try:
-        r = requests.get(
+        with _CSE_LOCK:
+            row = _CSE_DB.execute("SELECT body FROM cse WHERE q=? AND day=?", (query, day)).fetchone()
+        if row:
+            return orjson.loads(row[0])
+    except Exception:
+        pass  # cache is best-effort; fall through to a live query
+    try:
+        r = SESSION.get(
             "https://www.googleapis.com/customsearch/v1",
-            params={"key":CSE_API_KEY,"cx":CSE_CX,"q":query,"num":num,"safe":"active","hl":"en"},
+            params={**_CSE_STATIC_PARAMS, "q": query, "num": num},
             timeout=20
         )
         r.raise_for_status()
-        items = r.json().get("items", []) or []
+        items = orjson.loads(r.content).get("items") or []
         out = []
         for it in items:
             title = it.get("title","")
@@ -169,23 +368,33 @@ def google_search_news(query: str, num: int = 6) -> List[Dict]:
                 "url":link,
                 "snippet":snippet,
                 "published":None,
-                "trusted": any(h in link for h in TRUSTED_HOSTS)
+                "trusted": _trusted(link)
             })
+        try:
+            with _CSE_LOCK:
+                _CSE_DB.execute("INSERT OR REPLACE INTO cse(q, day, ts, body) VALUES(?, ?, ?, ?)",
+                                (query, day, dt.now(timezone.utc).timestamp(), orjson.dumps(out)))
+                _CSE_DB.commit()
+        except Exception:
+            pass
         return out
     except Exception:
         return []
 
+def build_query(a: str) -> str:
+    return f'"{a}" {_CSE_SUFFIX}'
+
 def cse_hits_for_artists() -> List[Dict]:
     hits = []
-    for a in ARTISTS:
-        q = (f'"{a}" (news OR announces OR reveals OR controversy OR tour OR release OR update '
-             f'OR statement OR apology OR backlash OR lawsuit) '
-             f'site:(billboard.com OR rollingstone.com OR variety.com OR countrynow.com OR '
-             f'tasteofcountry.com OR theboot.com OR consequence.net)')
-        items = google_search_news(q, num=CSE_RESULTS_PER_ARTIST)
-        for it in items:
-            it["artist"] = a
-        hits.extend(items)
+    with ThreadPoolExecutor(max_workers=10) as ex:
+        futures = {ex.submit(google_search_news, build_query(a), CSE_RESULTS_PER_ARTIST): a
+                   for a in ARTISTS}
+        for f in as_completed(futures):
+            a = futures[f]
+            items = f.result()
+            for it in items:
+                it["artist"] = a
+            hits.extend(items)
     return hits
 
 # =========================
@@ -212,11 +421,21 @@ def bisoz_card(headline: str, artist: str, dek: str, links: List[Tuple[str,str]]
 </article>
 """.strip()
 
+def bisoz_card_text(headline: str, artist: str, dek: str, links: List[Tuple[str,str]]) -> str:
+    # Plaintext twin of bisoz_card for the Discord path: no escaping, no
+    # HTML build that would only be stripped straight back out.
+    headline = headline.strip() or f"{artist} Update"
+    lines = [headline, artist or "Country Music"]
+    if dek:
+        lines.append(dek.strip())
+    lines.append("")
+    lines.append("Sources:")
+    lines.extend(f"- {t or 'Source'}: {u}" for (t, u) in links if u)
+    return "\n".join(lines)
+
 def html_to_text(html: str, max_len: int = 1500) -> str:
     try:
-        soup = BeautifulSoup(html or "", "html.parser")
-        text = soup.get_text(" ", strip=True)
-        return text[:max_len]
+        return _strip_html(html)[:max_len]
     except Exception:
         return (html or "")[:max_len]
 
@@ -224,25 +443,65 @@ def html_to_text(html: str, max_len: int = 1500) -> str:
 # ALERT BUILDERS
 # =========================
 def build_rule_alerts(hits: List[Dict]) -> List[Dict]:
-    by_artist: Dict[str, List[Dict]] = {}
-    seen = set()
-    for h in hits:
-        if h["url"] in seen:
-            continue
-        seen.add(h["url"])
-        by_artist.setdefault(h["artist"], []).append(h)
+    # Hits arrive already deduped by run(). One global sort gives contiguous
+    # per-artist runs (trusted first, then by published), replacing the
+    # dict-of-lists bucketization plus per-artist sorts.
+    hits = sorted(hits, key=lambda h: (h["artist"] or "", not h["trusted"], h["published"] or ""))
 
     alerts = []
-    for artist, items in by_artist.items():
-        if not items:
-            continue
-        items.sort(key=lambda x: (not x["trusted"], (x["published"] or "")))
-        top = items[:5]
-        links = [(BeautifulSoup(x["title"], "html.parser").get_text() or x["url"], x["url"]) for x in top]
+    for artist, group in groupby(hits, key=lambda h: h["artist"]):
+        top = list(islice(group, 5))
+        links = [(_title_text(x["title"]) or x["url"], x["url"]) for x in top]
         headline = f"{artist} — Recent Mentions"
         dek = "A concise roundup of credible mentions in the last 24 hours."
-        html = bisoz_card(headline, artist, dek, links)
-        alerts.append({"title": headline, "html": html, "labels": ["Alert","Country Music","News"]})
+        text = bisoz_card_text(headline, artist, dek, links)
+        alerts.append({"title": headline, "text": text, "labels": ["Alert","Country Music","News"]})
+    return alerts
+
+# =========================
+# GEMINI ALERTS
+# =========================
+def gemini_alerts_from_evidence(by_artist: Dict[str, List[Dict]]) -> List[Dict]:
+    if not USE_GEMINI:
+        return []
+
+    async def _all():
+        # All artist prompts fly concurrently; the semaphore keeps us inside
+        # the model's concurrency quota.
+        model = genai.GenerativeModel(GEMINI_MODEL)
+        sem = asyncio.Semaphore(8)
+
+        async def _one(artist: str, evidence: List[Dict]):
+            prompt = (
+                "You write ByteSize-style country music news blurbs.\n"
+                f"Artist/topic: {artist}\n"
+                "Evidence (title | url | snippet):\n"
+                + "\n".join(f"- {h['title']} | {h['url']} | {h['snippet']}" for h in evidence[:8])
+                + "\nWrite a 2-3 sentence alert summarizing what is newsworthy. "
+                  "If nothing is newsworthy, reply with exactly NONE."
+            )
+            async with sem:
+                resp = await model.generate_content_async(prompt)
+            return artist, (getattr(resp, "text", "") or "").strip()
+
+        return await asyncio.gather(*(_one(a, ev) for a, ev in by_artist.items()),
+                                    return_exceptions=True)
+
+    try:
+        results = asyncio.run(_all())
+    except Exception as e:
+        print(f"[warn] Gemini batch failed: {e}")
+        return []
+
+    alerts = []
+    for res in results:
+        if isinstance(res, BaseException):
+            continue
+        artist, text = res
+        if not text or text.upper() == "NONE":
+            continue
+        alerts.append({"title": f"{artist} — ByteSize Update", "text": text,
+                       "labels": ["Alert","Country Music","News"]})
     return alerts
 
 # =========================
@@ -260,7 +519,14 @@ def run():
 
     rss = recent_rss_hits()
     cse = cse_hits_for_artists()
-    merged = rss + cse
+    seen = set()
+    merged = []
+    for h in rss + cse:
+        key = _canonical_url(h["url"])
+        if key in seen:
+            continue
+        seen.add(key)
+        merged.append(h)
 
     if DEBUG_PRINT:
         print(f"[retrieval] RSS:{len(rss)} CSE:{len(cse)} Artists:{len(ARTISTS)}")
@@ -272,12 +538,11 @@ def run():
         send_discord("CountryMusicAgent: no fresh signals in this cycle.")
         return
 
+    # Group the hit dicts themselves; they already carry the full schema,
+    # so no per-hit copy is needed here.
     by_artist: Dict[str, List[Dict]] = {}
     for h in merged:
-        by_artist.setdefault(h["artist"], []).append({
-            "title": h["title"], "url": h["url"], "snippet": h["snippet"],
-            "source": h["source"], "published": h["published"], "trusted": h["trusted"]
-        })
+        by_artist.setdefault(h["artist"], []).append(h)
 
     alerts: List[Dict] = []
     if USE_GEMINI:
@@ -293,11 +558,21 @@ def run():
         send_discord("CountryMusicAgent: no alerts triggered this run.")
         return
 
-    # Discord-only notifications
+    # Discord-only notifications, batched per webhook call: at most 10 embeds
+    # AND under the 6000-char combined limit across all embeds in a message.
+    batch: List[Dict] = []
+    batch_len = 0
     for a in alerts:
-        plain = html_to_text(a.get("html", ""))
-        msg = f"📰 {a.get('title', 'Alert')}\n{plain}"
-        send_discord(msg)
+        title = f"📰 {a.get('title', 'Alert')}"[:256]
+        desc = (a.get("text") or html_to_text(a.get("html", ""), 2048))[:2048]
+        size = len(title) + len(desc)
+        if batch and (len(batch) == 10 or batch_len + size > 5800):
+            send_discord(embeds=batch)
+            batch, batch_len = [], 0
+        batch.append({"title": title, "description": desc})
+        batch_len += size
+    if batch:
+        send_discord(embeds=batch)
 
     print(f"Sent {len(alerts)} alert(s) to Discord.")
 